@@ -1,14 +1,15 @@
 import os
+import csv
 import time
 import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import wave
 import pyaudio
 import numpy as np
 import pandas as pd
 import soundfile as sf
-import subprocess
 import pyperclip
 from pynput import keyboard as pynput_keyboard
 from faster_whisper import WhisperModel
@@ -20,12 +21,19 @@ CLIPBOARD_ENABLED = True
 MASTER_FOLDER = os.path.expanduser("/Users/dakthi/Downloads/make a new folder'")
 CSV_FILE = os.path.join(MASTER_FOLDER, "transcription.csv")
 MODEL_NAME = "medium"
+BEAM_SIZE = 1  # Greedy decoding keeps up with live chunks; 5 = beam search
 
-RECORD_SECONDS = 10
+RECORD_SECONDS = 10  # Longest chunk; cut earlier when speech is followed by a pause
+SPEECH_TO_NOISE = 3.0  # A read counts as speech when its RMS is this many times the noise floor
+PAUSE_SECONDS = 0.5
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 CHUNK = 1024
+SAMPLE_WIDTH = pyaudio.get_sample_size(FORMAT)
+READS_PER_CHUNK = int(RATE / CHUNK * RECORD_SECONDS)
+SAMPLES_PER_CHUNK = READS_PER_CHUNK * CHUNK
+PAUSE_READS = max(1, int(RATE / CHUNK * PAUSE_SECONDS))
 
 os.makedirs(MASTER_FOLDER, exist_ok=True)
 
@@ -39,47 +47,93 @@ logging.basicConfig(
 model = WhisperModel(
     MODEL_NAME,
     device="cpu",
-    compute_type="int8"
+    compute_type="int8",
+    cpu_threads=os.cpu_count() or 0,
 )
 
-# 🧠 Event to signal clipboard + memory reset
-reset_event = threading.Event()
+# 🧠 Bumped on every clipboard + memory reset; copies queued before it are dropped
+reset_count = 0
 
 def ensure_csv_exists():
     if not os.path.exists(CSV_FILE):
         df = pd.DataFrame(columns=["Filename", "Transcription"])
         df.to_csv(CSV_FILE, index=False, encoding="utf-8-sig")
 
+def write_session_row(csv_file, row_offset, filename, transcription):
+    """
+    Rewrite this session's row in place; earlier rows are never re-read.
+    """
+    csv_file.truncate(row_offset)
+    csv.writer(csv_file, lineterminator="\n").writerow([filename, transcription])
+    csv_file.flush()
+
+def copy_to_clipboard(text, generation):
+    # Skip copies queued before a Cmd+Shift+X reset so they can't undo the clear
+    if generation == reset_count:
+        pyperclip.copy(text)
+
+def log_write_error(future):
+    if future.exception() is not None:
+        logging.error(f"Background write failed: {future.exception()}")
+
 def save_wav_file(filename, frames):
     path = os.path.join(MASTER_FOLDER, filename)
     wf = wave.open(path, 'wb')
     wf.setnchannels(CHANNELS)
-    wf.setsampwidth(pyaudio.PyAudio().get_sample_size(FORMAT))
+    wf.setsampwidth(SAMPLE_WIDTH)
     wf.setframerate(RATE)
-    wf.writeframes(b''.join(frames))
+    for chunk in frames:
+        wf.writeframes(chunk.tobytes())
     wf.close()
 
-def denoise_audio(input_path, output_path):
+def denoise_audio(frames, output_path):
     try:
-        subprocess.run([
-            "ffmpeg", "-y", "-i", input_path,
-            "-af", "afftdn",
-            output_path
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg denoise failed: {e}")
+        # Optional dependency: only needed when SHOULD_CLEAN_AUDIO is on
+        import noisereduce as nr
+
+        # Spectral gating on the samples already in memory, no ffmpeg round-trip
+        audio_data = np.multiply(np.concatenate(frames), np.float32(1.0 / 32768.0), dtype=np.float32)
+        cleaned = nr.reduce_noise(y=audio_data, sr=RATE, stationary=True)
+        sf.write(output_path, cleaned, RATE, subtype="PCM_16")
+    except Exception as e:
+        logging.error(f"Denoise failed: {e}")
 
 def record_audio(q):
     audio = pyaudio.PyAudio()
     stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
     logging.info("Recording started...")
+    noise_floor = None  # Running mean-square of background noise, tracked across chunks
     try:
         while True:
-            frames = []
-            for _ in range(0, int(RATE / CHUNK * RECORD_SECONDS)):
+            # Read straight into one int16 buffer per chunk instead of a list of bytes
+            samples = np.empty(SAMPLES_PER_CHUNK, dtype=np.int16)
+            has_speech = False
+            silent_reads = 0
+            for i in range(READS_PER_CHUNK):
                 data = stream.read(CHUNK, exception_on_overflow=False)
-                frames.append(data)
-            q.put(frames)
+                block = np.frombuffer(data, dtype=np.int16)
+                samples[i * CHUNK:(i + 1) * CHUNK] = block
+
+                # Cheap energy gate, relative to the noise floor: only decides where to cut
+                # the chunk (first pause after speech); silence itself is left to Whisper's VAD
+                energy = float(np.mean(np.square(block, dtype=np.float32)))
+                if noise_floor is None:
+                    noise_floor = max(energy, 1.0)
+                # Classify against the current floor first, then adapt it
+                if energy >= noise_floor * SPEECH_TO_NOISE ** 2:
+                    has_speech = True
+                    silent_reads = 0
+                else:
+                    silent_reads += 1
+                    # Only non-speech reads may raise the floor, so speech never trains it upward
+                    noise_floor += (energy - noise_floor) * 0.01
+                if energy < noise_floor:
+                    noise_floor = max(energy, 1.0)
+                if has_speech and silent_reads >= PAUSE_READS:
+                    break
+            n = (i + 1) * CHUNK
+            # Copy a chunk cut at a pause so it doesn't pin the full 10 s buffer in all_frames
+            q.put(samples[:n].copy() if n < SAMPLES_PER_CHUNK else samples)
     except KeyboardInterrupt:
         pass
     finally:
@@ -92,10 +146,11 @@ def listen_for_reset_clipboard():
     current_keys = set()
 
     def on_press(key):
+        global reset_count
         current_keys.add(key)
         if all(k in current_keys for k in COMBO):
+            reset_count += 1
             pyperclip.copy("")
-            reset_event.set()
             print("🧹 Manual clipboard + memory reset triggered (Cmd+Shift+X).")
             current_keys.clear()
 
@@ -112,30 +167,49 @@ def transcribe_live():
     all_frames = []
     full_transcription = ""
     clipboard_memory = ""
+    clipboard_generation = reset_count
     timestamp = time.strftime("%y%m%d_%H%M%S")
     raw_filename = f"{timestamp}.wav"
     cleaned_filename = raw_filename.replace(".wav", "_cleaned.wav")
+    np_audio = np.empty(SAMPLES_PER_CHUNK, dtype=np.float32)
 
     threading.Thread(target=record_audio, args=(audio_queue,), daemon=True).start()
     threading.Thread(target=listen_for_reset_clipboard, daemon=True).start()
 
-    print("\n🎙️ Recording in 10-second chunks. Press Ctrl+C to stop...")
+    print(f"\n🎙️ Recording in chunks of up to {RECORD_SECONDS} seconds, cut at pauses. Press Ctrl+C to stop...")
     print("📋 Press Cmd+Shift+X to clear the clipboard + reset memory.\n")
 
+    # Session row is always appended at the end of the CSV, so keep the file
+    # open and only rewrite from where our row starts.
+    csv_file = open(CSV_FILE, "a", newline="", encoding="utf-8")
+    row_offset = csv_file.tell()
+    # CSV + clipboard writes (pbcopy) run in order on one worker while the next chunk is transcribed
+    writer = ThreadPoolExecutor(max_workers=1)
+
     try:
         while True:
-            frames = audio_queue.get()
-            all_frames.extend(frames)
+            samples = audio_queue.get()
+            all_frames.append(samples)
 
-            # 🧠 Reset clipboard memory if triggered
-            if reset_event.is_set():
+            # 🧠 Reset clipboard memory if triggered; one read of the counter decides
+            # both the reset and the generation the copy below is tagged with
+            generation = reset_count
+            if generation != clipboard_generation:
                 clipboard_memory = ""
-                reset_event.clear()
+                clipboard_generation = generation
 
             # Transcribe chunk
-            audio_data = b"".join(frames)
-            np_audio = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
-            segments, _ = model.transcribe(np_audio, beam_size=5)
+            chunk_audio = np_audio[:len(samples)]
+            np.multiply(samples, np.float32(1.0 / 32768.0), out=chunk_audio, dtype=np.float32, casting="unsafe")
+            segments, _ = model.transcribe(
+                chunk_audio,
+                beam_size=BEAM_SIZE,
+                vad_filter=True,
+                vad_parameters=dict(min_silence_duration_ms=500),
+                condition_on_previous_text=False,
+                without_timestamps=True,
+                temperature=0,
+            )
             chunk_text = "".join([segment.text for segment in segments]).strip()
 
             if chunk_text:
@@ -144,22 +218,18 @@ def transcribe_live():
 
                 # Append and update cumulative transcription in CSV
                 full_transcription += " " + chunk_text
-                df = pd.read_csv(CSV_FILE) if os.path.exists(CSV_FILE) else pd.DataFrame(columns=["Filename", "Transcription"])
-
-                if raw_filename in df["Filename"].values:
-                    df.loc[df["Filename"] == raw_filename, "Transcription"] = full_transcription.strip()
-                else:
-                    new_row = pd.DataFrame([{"Filename": raw_filename, "Transcription": full_transcription.strip()}])
-                    df = pd.concat([df, new_row], ignore_index=True)
-
-                df.to_csv(CSV_FILE, index=False, encoding="utf-8-sig")
+                future = writer.submit(write_session_row, csv_file, row_offset, raw_filename, full_transcription.strip())
+                future.add_done_callback(log_write_error)
 
                 # 📋 Clipboard handling
                 if CLIPBOARD_ENABLED:
                     clipboard_memory += " " + chunk_text
-                    pyperclip.copy(clipboard_memory.strip())
+                    future = writer.submit(copy_to_clipboard, clipboard_memory.strip(), clipboard_generation)
+                    future.add_done_callback(log_write_error)
 
     except KeyboardInterrupt:
+        writer.shutdown(wait=True)
+        csv_file.close()
         print("\n🔁 Finalising...")
 
         if len(all_frames) == 0:
@@ -168,11 +238,10 @@ def transcribe_live():
 
         if SHOULD_SAVE_AUDIO:
             save_wav_file(raw_filename, all_frames)
-            raw_path = os.path.join(MASTER_FOLDER, raw_filename)
 
             if SHOULD_CLEAN_AUDIO:
                 cleaned_path = os.path.join(MASTER_FOLDER, cleaned_filename)
-                denoise_audio(raw_path, cleaned_path)
+                denoise_audio(all_frames, cleaned_path)
                 print(f"✅ Cleaned audio saved as: {cleaned_filename}")
             else:
                 print(f"✅ Audio saved as: {raw_filename}")
@@ -1,31 +1,36 @@
 import re
 import os
+import csv
+import json
+import hashlib
 import pandas as pd
 import logging
-import time
-import subprocess
+import ctranslate2
 from tqdm import tqdm
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
+
+# Các cụm thường gặp để loại bỏ
+HALLUCINATION_PATTERNS = [
+    r"Hãy subscribe cho kênh.*?(?:video hấp dẫn|để không bỏ lỡ|La La School).*?",  # loại bỏ cả cụm
+    r"Ghiền Mì Gõ",
+    r"Cảm ơn các bạn đã theo dõi và hẹn gặp lại.",
+    r"La La School", 
+    r"để không bỏ lỡ.*?video hấp dẫn",
+    r"những video hấp dẫn",
+    r"hã",
+]
+# Gộp thành một regex duy nhất, compile một lần khi import
+HALLUCINATION_RE = re.compile("|".join(f"(?:{p})" for p in HALLUCINATION_PATTERNS), flags=re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s{2,}")
 
 def clean_hallucinations(text):
     """
     Loại bỏ những cụm không mong muốn trong transcript
     """
-    # Các cụm thường gặp để loại bỏ
-    patterns = [
-        r"Hãy subscribe cho kênh.*?(?:video hấp dẫn|để không bỏ lỡ|La La School).*?",  # loại bỏ cả cụm
-        r"Ghiền Mì Gõ",
-        r"Cảm ơn các bạn đã theo dõi và hẹn gặp lại.",
-        r"La La School", 
-        r"để không bỏ lỡ.*?video hấp dẫn",
-        r"những video hấp dẫn",
-        r"hã",
-    ]
-    for pattern in patterns:
-        text = re.sub(pattern, "", text, flags=re.IGNORECASE)
-    
+    text = HALLUCINATION_RE.sub("", text)
+
     # Dọn whitespace dư thừa
-    text = re.sub(r"\s{2,}", " ", text).strip()
+    text = WHITESPACE_RE.sub(" ", text).strip()
     return text
 
 # Configure logging
@@ -39,14 +44,27 @@ logging.basicConfig(
 # Define paths
 MASTER_FOLDER = os.path.expanduser("/Users/dakthi/Downloads/Organized/Folders/Folders/python-transcribe")
 CSV_FILE = os.path.join(MASTER_FOLDER, "transcription.csv")
-SEGMENTS_FOLDER = os.path.join(MASTER_FOLDER, "segments")
+HASH_INDEX_FILE = os.path.join(MASTER_FOLDER, "transcription_hashes.json")
+
+AUDIO_EXTENSIONS = frozenset({".mp3", ".wav", ".m4a"})
 
-# Ensure segments folder exists
-os.makedirs(SEGMENTS_FOLDER, exist_ok=True)
+SAMPLE_RATE = 16000
+SEGMENT_SECONDS = 30
 
 # Load Faster-Whisper model
 MODEL_NAME = "medium"  # Hoặc "small", "base", v.v.
-model = WhisperModel(MODEL_NAME, compute_type="int8")
+LANGUAGE = None  # Ví dụ "vi" để bỏ qua bước nhận diện ngôn ngữ
+# Dùng GPU với FP16 nếu có CUDA, nếu không thì CPU int8
+DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+COMPUTE_TYPE = "float16" if DEVICE == "cuda" else "int8"
+model = WhisperModel(MODEL_NAME, device=DEVICE, compute_type=COMPUTE_TYPE, cpu_threads=os.cpu_count() or 0)
+# Encode nhiều đoạn 30 giây cùng lúc thay vì từng đoạn một
+batched_model = BatchedInferencePipeline(model=model)
+BATCH_SIZE = 8
+
+# Transcript theo basename, nạp từ CSV một lần khi khởi động
+transcriptions = {}
+CSV_FLUSH_EVERY = 20  # Ghi CSV sau mỗi N segment Whisper trả về
 
 def ensure_csv_exists():
     """
@@ -65,89 +83,110 @@ def clean_csv(df):
 
 def load_existing_transcriptions():
     """
-    Lấy ra danh sách các filename đã được xử lý trong CSV
+    Nạp các transcript đã có trong CSV vào bộ nhớ (chỉ đọc CSV một lần);
+    trả về None nếu không đọc được CSV
     """
     if os.path.exists(CSV_FILE):
-        df = pd.read_csv(CSV_FILE)
-        df = clean_csv(df)
+        try:
+            df = pd.read_csv(CSV_FILE)
+            df = clean_csv(df)
+        except Exception as e:
+            logging.error(f"[ERROR] Reading CSV: {e}")
+            return None
         if "Filename" in df:
-            return set(df["Filename"].apply(os.path.basename).astype(str))
-    return set()
+            # Các dòng mới luôn lưu basename; dòng cũ có thể còn đường dẫn đầy đủ
+            filenames = df["Filename"].astype(str).str.rsplit(os.sep, n=1).str[-1]
+            # Thiếu cột Transcription: vẫn coi là đã xử lý, nhưng không dùng làm cache
+            texts = df["Transcription"] if "Transcription" in df else [None] * len(df)
+            transcriptions.update(zip(filenames, texts))
+    return transcriptions
 
-def update_csv(filename, transcription):
+def update_csv(csv_file, row_offset, filename, transcription):
     """
-    Cập nhật (hoặc thêm) bản ghi transcript vào CSV
+    Ghi (lại) dòng của file đang xử lý ở cuối CSV, bắt đầu từ row_offset;
+    các dòng phía trước không bao giờ bị đọc lại hay ghi lại
     """
     base_filename = os.path.basename(filename)
-    try:
-        df = pd.read_csv(CSV_FILE)
-        df = clean_csv(df)
-    except Exception as e:
-        logging.error(f"[ERROR] Reading CSV: {e}")
-        df = pd.DataFrame(columns=["Filename", "Transcription"])
+    transcriptions[base_filename] = transcription
+    csv_file.truncate(row_offset)
+    csv.writer(csv_file, lineterminator="\n").writerow([base_filename, transcription])
+    csv_file.flush()
+
+def file_hash(file_path):
+    """
+    Hash blake2b của toàn bộ nội dung file, đọc theo từng khối 1 MB
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
 
-    if base_filename in df["Filename"].apply(os.path.basename).values:
-        df.loc[df["Filename"].apply(os.path.basename) == base_filename, "Transcription"] = transcription
-    else:
-        new_row = pd.DataFrame([{"Filename": base_filename, "Transcription": transcription}])
-        df = pd.concat([df, new_row], ignore_index=True)
+def load_hash_index():
+    """
+    Nạp bảng {hash nội dung: [filename đã transcribe, các bản sao cùng nội dung...]}
+    """
+    if os.path.exists(HASH_INDEX_FILE):
+        try:
+            with open(HASH_INDEX_FILE, encoding="utf-8") as f:
+                hash_index = json.load(f)
+            return {h: [names] if isinstance(names, str) else names for h, names in hash_index.items()}
+        except Exception as e:
+            logging.error(f"[ERROR] Reading hash index: {e}")
+    return {}
 
-    df.to_csv(CSV_FILE, index=False, encoding="utf-8-sig")
+def save_hash_index(hash_index):
+    """
+    Lưu bảng hash nội dung ra file JSON (ghi ra file tạm rồi thay thế,
+    để Ctrl+C giữa chừng không làm hỏng file cũ)
+    """
+    tmp_path = HASH_INDEX_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(hash_index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, HASH_INDEX_FILE)
 
-def transcribe_audio_local(file_path):
+def transcribe_audio_local(file_path, csv_file):
     """
-    Chia file âm thanh thành các segment 30 giây, 
-    transcribe từng segment, 
+    Giải mã file âm thanh một lần trong bộ nhớ,
+    transcribe theo batch các đoạn tối đa 30 giây,
     ghép lại thành 1 transcript hoàn chỉnh,
     sau đó lưu vào CSV.
     """
     base_filename = os.path.basename(file_path)
     logging.info(f"[START] Transcribing: {base_filename}")
-    transcription = ""
+    transcription_parts = []
+    row_offset = csv_file.tell()
 
     try:
-        file_segments_dir = os.path.join(SEGMENTS_FOLDER, os.path.splitext(base_filename)[0])
-        os.makedirs(file_segments_dir, exist_ok=True)
-
-        # Tạo pattern cho segment đầu ra
-        output_pattern = os.path.join(file_segments_dir, f"{base_filename}_%03d.wav")
-
-        # Chia file gốc thành các segment 30 giây
-        cmd = [
-            "ffmpeg", "-i", file_path,
-            "-f", "segment", "-segment_time", "30",
-            "-c:a", "pcm_s16le", "-ar", "16000", "-ac", "1",
-            output_pattern
-        ]
-        subprocess.run(cmd, check=True)
-
-        segment_files = sorted(
-            [os.path.join(file_segments_dir, f) for f in os.listdir(file_segments_dir) if f.endswith(".wav")]
-        )
+        # Giải mã file một lần thành mono float32 16 kHz
+        audio = decode_audio(file_path, sampling_rate=SAMPLE_RATE)
 
-        if not segment_files:
-            logging.error(f"[ERROR] No segments created for {base_filename}.")
+        if len(audio) == 0:
+            logging.error(f"[ERROR] No audio decoded for {base_filename}.")
             return None
 
-        # Nhận diện ngôn ngữ từ segment đầu tiên
-        segments, info = model.transcribe(segment_files[0], beam_size=5)
-        detected_lang = info.language
+        # Nhận diện ngôn ngữ từ 30 giây đầu tiên (chỉ chạy encoder, không decode)
+        if LANGUAGE:
+            detected_lang = LANGUAGE
+        else:
+            detected_lang, _, _ = model.detect_language(audio[:SAMPLE_RATE * SEGMENT_SECONDS])
         logging.info(f"[INFO] Detected Language: {detected_lang}")
 
-        # Xử lý từng segment
-        with tqdm(total=len(segment_files), desc=f"Processing {base_filename}", unit="segment") as pbar:
-            for seg in segment_files:
-                segments, _ = model.transcribe(seg, language=detected_lang, beam_size=5)
-                for segment in segments:
-                    transcription += " " + segment.text
+        # Transcribe cả file theo batch, tiến độ tính theo giây âm thanh
+        segments, info = batched_model.transcribe(audio, language=detected_lang, beam_size=5, batch_size=BATCH_SIZE)
+        with tqdm(total=round(info.duration), desc=f"Processing {base_filename}", unit="s") as pbar:
+            for i, segment in enumerate(segments, start=1):
+                transcription_parts.append(segment.text)
 
-                # Làm sạch tạm thời & cập nhật CSV sau mỗi segment
-                cleaned_partial = clean_hallucinations(transcription.strip())
-                update_csv(base_filename, cleaned_partial)
+                # Làm sạch tạm thời & cập nhật CSV sau mỗi N segment
+                if i % CSV_FLUSH_EVERY == 0:
+                    update_csv(csv_file, row_offset, base_filename, clean_hallucinations(" ".join(transcription_parts).strip()))
 
-                pbar.update(1)
-                time.sleep(0.1)
+                pbar.n = min(round(segment.end), pbar.total)
+                pbar.refresh()
 
+        transcription = " ".join(transcription_parts).strip()
+        update_csv(csv_file, row_offset, base_filename, clean_hallucinations(transcription))
         logging.info(f"[COMPLETED] {base_filename} - Transcription saved.")
         return transcription
 
@@ -162,19 +201,62 @@ def main():
 
     ensure_csv_exists()
     existing_files = load_existing_transcriptions()
+    if existing_files is None:
+        # Không đọc được CSV thì dừng, tránh transcribe lại toàn bộ thư mục
+        return
+    hash_index = load_hash_index()
+    indexed_files = {name for names in hash_index.values() for name in names}
+    index_dirty = False
 
-    for file in os.listdir(MASTER_FOLDER):
-        if file.endswith((".mp3", ".wav", ".m4a", ".WAV", ".MP3")):
+    with os.scandir(MASTER_FOLDER) as entries:
+        audio_entries = [
+            entry for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS
+        ]
+
+    # Bổ sung hash cho mọi file đã transcribe trước khi tra cache,
+    # để bản sao đứng trước file gốc trong thư mục vẫn tìm thấy transcript
+    for entry in audio_entries:
+        if entry.name in existing_files and entry.name not in indexed_files:
+            # Tên mới được thêm vào sau; file gốc vẫn đứng đầu danh sách
+            hash_index.setdefault(file_hash(entry.path), []).append(entry.name)
+            indexed_files.add(entry.name)
+            index_dirty = True
+
+    # Mở CSV một lần ở chế độ append; mỗi file mới chỉ ghi thêm dòng của nó
+    with open(CSV_FILE, "a", newline="", encoding="utf-8") as csv_file:
+        for entry in audio_entries:
+            file = entry.name
+            file_path = entry.path
             if file in existing_files:
                 logging.info(f"[SKIP] Already processed: {file}")
                 continue
 
-            file_path = os.path.join(MASTER_FOLDER, file)
+            # File đổi tên / copy lại: dùng lại transcript của file có cùng nội dung
+            content_hash = file_hash(file_path)
+            cached_file = hash_index.get(content_hash, [None])[0]
+            if isinstance(transcriptions.get(cached_file), str):
+                logging.info(f"[CACHE] {file} has the same content as {cached_file}")
+                update_csv(csv_file, csv_file.tell(), file, transcriptions[cached_file])
+                # Ghi nhận bản sao để lần sau không phải hash lại
+                hash_index[content_hash].append(file)
+                indexed_files.add(file)
+                index_dirty = True
+                continue
+
             logging.info(f"[PROCESSING] {file}")
-            transcript = transcribe_audio_local(file_path)
+            transcript = transcribe_audio_local(file_path, csv_file)
 
             if transcript:
+                hash_index.setdefault(content_hash, []).insert(0, file)
+                indexed_files.add(file)
+                save_hash_index(hash_index)
+                index_dirty = False
                 logging.info(f"[DONE] {file} - Transcription saved.")
 
+    # Ghi bảng hash một lần sau khi quét, thay vì sau mỗi file được bổ sung
+    if index_dirty:
+        save_hash_index(hash_index)
+
 if __name__ == "__main__":
     main()
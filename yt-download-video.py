@@ -1,10 +1,13 @@
+import sys
 import yt_dlp
 
-url = "https://www.youtube.com/watch?v=ZhCBEfLwEr4"
+# Pass one or more URLs on the command line; they all share one downloader
+urls = sys.argv[1:] or ["https://www.youtube.com/watch?v=ZhCBEfLwEr4"]
 ydl_opts = {
     "format": "best",
-    "outtmpl": "%(title)s.%(ext)s"
+    "outtmpl": "%(title)s.%(ext)s",
+    "concurrent_fragment_downloads": 4,  # Fetch DASH/HLS fragments in parallel
 }
 
 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-    ydl.download([url])
+    ydl.download(urls)